@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Offline batch renderer for pre-rendering catalog tiles into showcase rooms.
+
+Usage:
+    python batch_render.py manifest.json [--workers 4] [--batch-size 4]
+
+Manifest format:
+    {
+        "output_dir": "renders",
+        "rooms": ["rooms/living_room.jpg", ...],
+        "tiles": ["tiles/tiles1_glossy.webp", ...],
+        "params": [
+            {"name": "floor_default", "surface": "floor", "tiles_x": 25, "tiles_y": 18,
+             "grout_width": 2, "grout_color": "#F0EBE4"},
+            {"name": "wall_small", "surface": "wall", "tiles_x": 20, "tiles_y": 15}
+        ]
+    }
+
+Every room x tile x params combination is rendered to
+<output_dir>/<room>/<tile>__<params name>.png. Finished jobs are appended to a
+checkpoint file together with the params they were rendered with, so an
+interrupted run resumes where it stopped. Jobs whose output already exists are
+skipped unless the checkpoint shows it was rendered with different params.
+A room that cannot be loaded or segmented fails only its own jobs.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+
+# Add current directory to path for imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from room_tiler import CompleteRoomTiler, hex_to_rgb, as_rgb_array, encode_image
+from shared_arrays import share_array, attach_array, release
+
+SURFACES = ("floor", "wall", "both")
+DEFAULT_FLOOR_PARAMS = {"tiles_x": 25, "tiles_y": 18, "grout_width": 2, "grout_color": "#F0EBE4"}
+DEFAULT_WALL_PARAMS = {"tiles_x": 20, "tiles_y": 15, "grout_width": 2, "grout_color": "#F5F0EB"}
+
+# Render-only tiler owned by each worker process
+_worker_tiler = None
+
+
+def stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """Load and validate a batch manifest"""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    for key in ("rooms", "tiles", "params"):
+        if not manifest.get(key):
+            raise ValueError(f"Manifest must list at least one entry in '{key}'")
+
+    names = set()
+    for params in manifest["params"]:
+        if "name" not in params:
+            raise ValueError("Every params entry needs a 'name'")
+        if params["name"] in names:
+            raise ValueError(f"Duplicate params name: {params['name']}")
+        names.add(params["name"])
+        if params.get("surface", "floor") not in SURFACES:
+            raise ValueError(f"Unknown surface '{params['surface']}', expected one of {SURFACES}")
+
+    for path in manifest["rooms"] + manifest["tiles"]:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {path}")
+
+    # Job ids and output paths are built from file stems, so they must be unique
+    for key in ("rooms", "tiles"):
+        stems = {}
+        for path in manifest[key]:
+            if stem(path) in stems:
+                raise ValueError(f"Duplicate {key[:-1]} name '{stem(path)}': {stems[stem(path)]} and {path}")
+            stems[stem(path)] = path
+
+    manifest.setdefault("output_dir", "renders")
+    return manifest
+
+
+def build_jobs(manifest: dict) -> dict:
+    """Expand the manifest into render jobs grouped by room"""
+    jobs_by_room = {}
+    for room_path in manifest["rooms"]:
+        jobs = []
+        for tile_path in manifest["tiles"]:
+            for params in manifest["params"]:
+                job_id = f"{stem(room_path)}/{stem(tile_path)}__{params['name']}"
+                jobs.append({
+                    "id": job_id,
+                    "room_path": room_path,
+                    "tile_path": tile_path,
+                    "params": params,
+                    "output_path": os.path.join(manifest["output_dir"], f"{job_id}.png"),
+                })
+        jobs_by_room[room_path] = jobs
+    return jobs_by_room
+
+
+def params_fingerprint(params: dict) -> str:
+    return json.dumps(params, sort_keys=True)
+
+
+def load_checkpoint(checkpoint_path: str) -> dict:
+    """Read the params fingerprints of jobs finished by previous runs, keyed by job id"""
+    if not os.path.exists(checkpoint_path):
+        return {}
+
+    done = {}
+    with open(checkpoint_path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                done[entry["id"]] = entry["params"]
+    return done
+
+
+def is_pending(job: dict, done: dict) -> bool:
+    """A job needs rendering if its output is missing or was rendered with other params"""
+    if not os.path.exists(job["output_path"]):
+        return True
+    return job["id"] in done and done[job["id"]] != params_fingerprint(job["params"])
+
+
+def _init_worker():
+    global _worker_tiler
+    # The process pool already uses every core, so render strips on one thread
+    _worker_tiler = CompleteRoomTiler(load_models=False, chunk_workers=1)
+
+
+def _surface_settings(params: dict, defaults: dict) -> tuple:
+    settings = {**defaults, **params}
+    return (settings["tiles_x"], settings["tiles_y"], settings["grout_width"],
+            hex_to_rgb(settings["grout_color"]))
+
+
+def _render_arrays(job: dict, arrays: dict):
+    """Render one job from the room array and its (mask, matte) arrays"""
+    tiler = _worker_tiler
+    params = job["params"]
+    surface = params.get("surface", "floor")
+
+    tile_img = Image.open(job["tile_path"]).convert("RGB")
+    result = arrays["room"]
+    room_height, room_width = result.shape[:2]
+
+    if surface in ("floor", "both"):
+        tiles_x, tiles_y, grout_width, grout_rgb = _surface_settings(params, DEFAULT_FLOOR_PARAMS)
+        generated_floor = tiler.generate_floor_tiles(
+            tile_img, room_width, room_height, tiles_x, tiles_y, grout_width, grout_rgb
+        )
+        warped_floor = tiler.apply_perspective_to_floor(generated_floor, arrays["floor_mask"], result)
+        result = tiler.blend_with_lighting(result, warped_floor, arrays["floor_mask"], is_floor=True,
+                                           matte=arrays["floor_matte"])
+
+    if surface in ("wall", "both"):
+        tiles_x, tiles_y, grout_width, grout_rgb = _surface_settings(params, DEFAULT_WALL_PARAMS)
+        generated_wall = tiler.generate_wall_tiles(
+            tile_img, room_width, room_height, tiles_x, tiles_y, grout_width, grout_rgb
+        )
+        wall_texture = tiler.apply_wall_texture(generated_wall, arrays["wall_mask"])
+        result = tiler.blend_with_lighting(result, wall_texture, arrays["wall_mask"], is_floor=False,
+                                           matte=arrays["wall_matte"])
+
+    return encode_image(result)
+
+
+def render_job(job: dict, handles: dict) -> str:
+    """Render one room x tile x params job from shared room arrays (runs in a worker process)"""
+    segments = []
+    arrays = {}
+    try:
+        for name, handle in handles.items():
+            shm, arrays[name] = attach_array(handle)
+            segments.append(shm)
+        data = _render_arrays(job, arrays)
+    finally:
+        # Drop the views before unmapping the segments
+        arrays.clear()
+        for shm in segments:
+            shm.close()
+
+    # Write atomically so an interrupted run never leaves a half-written output behind
+    output_path = job["output_path"]
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, output_path)
+    return job["id"]
+
+
+def share_room(room_np, floor_layers, wall_layers) -> tuple:
+    """Put a room and its (mask, matte) pairs into shared memory for the workers"""
+    arrays = {"room": room_np}
+    if floor_layers is not None:
+        arrays["floor_mask"], arrays["floor_matte"] = floor_layers
+    if wall_layers is not None:
+        arrays["wall_mask"], arrays["wall_matte"] = wall_layers
+
+    segments = []
+    handles = {}
+    for name, array in arrays.items():
+        shm, handles[name] = share_array(array)
+        segments.append(shm)
+    return segments, handles
+
+
+def segment_rooms(segmenter, room_images: list, surfaces: set) -> tuple:
+    """Batch-segment rooms into per-room (mask, matte) pairs for the surfaces that are rendered"""
+    floor_layers = [None] * len(room_images)
+    wall_layers = [None] * len(room_images)
+    if surfaces & {"floor", "both"}:
+        floor_layers = [(mask, segmenter.refine_mask(mask, image))
+                        for mask, image in zip(segmenter.detect_floor_masks(room_images), room_images)]
+    if surfaces & {"wall", "both"}:
+        wall_layers = [(mask, segmenter.refine_mask(mask, image))
+                       for mask, image in zip(segmenter.detect_wall_masks(room_images), room_images)]
+    return floor_layers, wall_layers
+
+
+def run_batch(manifest: dict, workers: int, batch_size: int, checkpoint_path: str,
+              max_in_flight: int) -> dict:
+    """Render every pending job in the manifest and return run statistics"""
+    jobs_by_room = build_jobs(manifest)
+    done = load_checkpoint(checkpoint_path)
+    total_jobs = sum(len(jobs) for jobs in jobs_by_room.values())
+
+    # Drop jobs finished by an earlier run or whose output is already on disk
+    pending_by_room = {}
+    for room_path, jobs in jobs_by_room.items():
+        pending = [job for job in jobs if is_pending(job, done)]
+        if pending:
+            pending_by_room[room_path] = pending
+    pending_jobs = sum(len(jobs) for jobs in pending_by_room.values())
+    stats = {"total": total_jobs, "skipped": total_jobs - pending_jobs, "rendered": 0, "failed": 0}
+
+    print(f"=== Batch Render: {total_jobs} jobs, {stats['skipped']} already done, {pending_jobs} pending ===")
+    if not pending_jobs:
+        return stats
+
+    segmenter = CompleteRoomTiler()
+    start_time = time.time()
+    room_paths = list(pending_by_room)
+    in_flight = {}
+    # Shared memory segments per room, released once the room's last job finishes
+    room_segments = {}
+    remaining_jobs = {path: len(jobs) for path, jobs in pending_by_room.items()}
+
+    def collect(return_when):
+        finished, _ = wait(in_flight, return_when=return_when)
+        for future in finished:
+            job = in_flight.pop(future)
+            try:
+                future.result()
+                checkpoint.write(json.dumps({
+                    "id": job["id"], "params": params_fingerprint(job["params"])
+                }) + "\n")
+                checkpoint.flush()
+                stats["rendered"] += 1
+            except Exception as e:
+                print(f"❌ Failed {job['id']}: {e}")
+                stats["failed"] += 1
+
+            remaining_jobs[job["room_path"]] -= 1
+            if remaining_jobs[job["room_path"]] == 0:
+                release(room_segments.pop(job["room_path"]))
+
+        completed = stats["rendered"] + stats["failed"]
+        elapsed = time.time() - start_time
+        print(f"Progress: {completed}/{pending_jobs} ({completed / elapsed:.2f} renders/s)")
+
+    def fail_rooms(paths, error):
+        # A room that cannot be loaded or segmented fails its own jobs, not the run
+        for path in paths:
+            print(f"❌ Failed room {path}: {error}")
+            stats["failed"] += remaining_jobs[path]
+            remaining_jobs[path] = 0
+
+    context = multiprocessing.get_context("spawn")
+    with open(checkpoint_path, "a") as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        try:
+            try:
+                for batch_start in range(0, len(room_paths), batch_size):
+                    batch_paths = room_paths[batch_start:batch_start + batch_size]
+                    print(f"\n--- Segmenting rooms {batch_start + 1}-{batch_start + len(batch_paths)} of {len(room_paths)} ---")
+
+                    loaded_paths, room_images = [], []
+                    for path in batch_paths:
+                        try:
+                            room_images.append(as_rgb_array(Image.open(path)))
+                            loaded_paths.append(path)
+                        except Exception as e:
+                            fail_rooms([path], e)
+
+                    surfaces = {job["params"].get("surface", "floor")
+                                for path in loaded_paths for job in pending_by_room[path]}
+                    try:
+                        floor_layers, wall_layers = segment_rooms(segmenter, room_images, surfaces)
+                    except Exception as e:
+                        fail_rooms(loaded_paths, e)
+                        continue
+
+                    for path, room_np, room_floor_layers, room_wall_layers in zip(
+                            loaded_paths, room_images, floor_layers, wall_layers):
+                        # Workers map the room from shared memory instead of unpickling a copy per job
+                        room_segments[path], handles = share_room(room_np, room_floor_layers, room_wall_layers)
+                        for job in pending_by_room[path]:
+                            # Bound the number of queued jobs held in memory
+                            while len(in_flight) >= max_in_flight:
+                                collect(FIRST_COMPLETED)
+                            in_flight[pool.submit(render_job, job, handles)] = job
+                    del room_images, floor_layers, wall_layers
+            except BrokenProcessPool as e:
+                print(f"❌ Render workers crashed, no further jobs are submitted: {e}")
+
+            while in_flight:
+                collect(FIRST_COMPLETED)
+        finally:
+            # Queued jobs still map their rooms' segments, so let them finish before unlinking
+            wait(in_flight)
+            for segments in room_segments.values():
+                release(segments)
+
+    # Jobs never submitted because the worker pool broke
+    stats["failed"] += sum(remaining_jobs.values())
+
+    stats["elapsed"] = time.time() - start_time
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-render catalog tiles into showcase rooms")
+    parser.add_argument("manifest", help="Path to the JSON manifest of rooms, tiles and params")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Render worker processes")
+    parser.add_argument("--batch-size", type=int, default=4,
+                        help="Rooms segmented per model batch")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file (defaults to <output_dir>/.checkpoint.jsonl)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Maximum queued render jobs (defaults to 2x workers)")
+    args = parser.parse_args(argv)
+
+    manifest = load_manifest(args.manifest)
+    os.makedirs(manifest["output_dir"], exist_ok=True)
+    checkpoint_path = args.checkpoint or os.path.join(manifest["output_dir"], ".checkpoint.jsonl")
+
+    stats = run_batch(
+        manifest,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        checkpoint_path=checkpoint_path,
+        max_in_flight=args.max_in_flight or args.workers * 2,
+    )
+
+    print(f"\n=== Batch Complete ===")
+    print(f"Rendered: {stats['rendered']}, skipped: {stats['skipped']}, failed: {stats['failed']}")
+    if stats.get("elapsed"):
+        print(f"Elapsed: {stats['elapsed']:.1f}s ({stats['rendered'] / stats['elapsed']:.2f} renders/s)")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
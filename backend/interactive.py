@@ -0,0 +1,218 @@
+"""
+Interactive editing sessions for the WebSocket channel.
+
+A client binds a room (and optionally floor/wall tiles) to its connection and
+then streams render requests. Only the most recent request is kept: requests
+that arrive while a render is running replace the queued one, and a finished
+render is dropped without encoding or sending if a newer request came in
+meanwhile (latest wins). Renders go through the shared RenderCache, so a
+session reuses the masks, lighting and tile layers of its room.
+
+Protocol (JSON text messages from the client):
+    {"type": "bind", "room_image": "<base64>", "floor_tile": "<base64>", "wall_tile": "<base64>"}
+    {"type": "render", "id": 7, "mode": "floor-tiling", "format": "PNG", "params": {"grout_color": "#F0EBE4"}}
+    (format is PNG or JPEG, PNG by default)
+
+Server replies:
+    {"type": "bound", "room": "<room key>", "width": 1600, "height": 1200}
+    {"type": "frame", "id": 7, "mode": "floor-tiling", "format": "PNG", "skipped": 3}
+    followed by one binary message with the encoded frame
+    {"type": "error", "id": 7, "detail": "..."}
+"""
+import asyncio
+import base64
+import json
+
+import numpy as np
+from fastapi import WebSocket
+from starlette.concurrency import run_in_threadpool
+
+from render_cache import RenderCache
+from room_tiler import IMAGE_FORMATS, hex_to_rgb, encode_image
+
+RENDER_MODES = ("floor-tiling", "wall-tiling", "wall-coloring", "floor-tiling-wall-coloring")
+FLOOR_DEFAULTS = {"tiles_x": 25, "tiles_y": 18, "grout_width": 2, "grout_color": "#F0EBE4"}
+WALL_DEFAULTS = {"tiles_x": 20, "tiles_y": 15, "grout_width": 2, "grout_color": "#F5F0EB"}
+MIN_VALUES = {"tiles_x": 1, "tiles_y": 1, "grout_width": 0}
+
+
+def resolve_params(params: dict, defaults: dict, required: tuple = ()) -> dict:
+    """Merge request params over defaults, validating integer fields and converting colors to RGB"""
+    if not isinstance(params, dict):
+        raise ValueError("'params' must be an object")
+    for name in required:
+        if name not in params:
+            raise ValueError(f"Missing parameter '{name}'")
+
+    resolved = dict(defaults)
+    for name in list(defaults) + list(required):
+        if name in params:
+            resolved[name] = params[name]
+
+    for name, value in resolved.items():
+        if name.endswith("_color"):
+            try:
+                resolved[name] = hex_to_rgb(value)
+            except (AttributeError, ValueError):
+                raise ValueError(f"Invalid '{name}': {value!r} (expected a hex color such as #F0EBE4)")
+        else:
+            # Accept integers and integer strings; bool is an int subclass but never a valid count
+            if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+                value = int(value)
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError(f"Invalid '{name}': {resolved[name]!r} (expected an integer)")
+            if value < MIN_VALUES.get(name, 0):
+                raise ValueError(f"Invalid '{name}': {value!r} (must be at least {MIN_VALUES.get(name, 0)})")
+            resolved[name] = value
+    return resolved
+
+
+class InteractiveSession:
+    """Per-connection state for the interactive editing channel"""
+
+    def __init__(self, websocket: WebSocket, render_cache: RenderCache):
+        self.websocket = websocket
+        self.render_cache = render_cache
+        self.room = None
+        self.tiles = {}
+        self.latest = None
+        self.generation = 0
+        self.skipped = 0
+        self._wakeup = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+
+    async def send_json(self, message: dict):
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+    async def send_frame(self, header: dict, data: memoryview):
+        # Keep the header and its binary payload adjacent on the wire
+        async with self._send_lock:
+            await self.websocket.send_json(header)
+            # ASGI WebSocket messages must carry bytes
+            await self.websocket.send_bytes(bytes(data))
+
+    async def receive(self, text: str):
+        """Parse one client message, replying with an error instead of failing the connection"""
+        try:
+            if text is None:
+                raise ValueError("Expected a JSON text message")
+            message = json.loads(text)
+            if not isinstance(message, dict):
+                raise ValueError("Expected a JSON object")
+        except ValueError as e:
+            await self.send_json({"type": "error", "detail": f"Invalid message: {str(e)}"})
+            return
+        await self.handle(message)
+
+    async def handle(self, message: dict):
+        """Handle one client message"""
+        message_type = message.get("type")
+        if message_type == "bind":
+            await self.bind(message)
+        elif message_type == "render":
+            self.submit(message)
+        else:
+            await self.send_json({"type": "error", "detail": f"Unknown message type: {message_type}"})
+
+    async def bind(self, message: dict):
+        """Bind a room and/or tiles to the session"""
+        try:
+            for name in ("floor_tile", "wall_tile"):
+                if message.get(name):
+                    self.tiles[name] = base64.b64decode(message[name])
+
+            if message.get("room_image"):
+                room_bytes = base64.b64decode(message["room_image"])
+                self.room = await run_in_threadpool(self.render_cache.room, room_bytes)
+                # Drop queued and in-flight frames that were rendered for the previous room
+                self.latest = None
+                self.generation += 1
+                self._wakeup.clear()
+
+            if self.room is None:
+                raise ValueError("No room bound to this session")
+
+            await self.send_json({
+                "type": "bound", "room": self.room.key,
+                "width": self.room.width, "height": self.room.height
+            })
+        except Exception as e:
+            await self.send_json({"type": "error", "detail": f"Bind error: {str(e)}"})
+
+    def submit(self, request: dict):
+        """Queue a render request, replacing any request that has not started yet"""
+        if self.latest is not None and self._wakeup.is_set():
+            self.skipped += 1
+        self.latest = request
+        self.generation += 1
+        self._wakeup.set()
+
+    def _is_stale(self, generation: int) -> bool:
+        return generation != self.generation
+
+    def render(self, request: dict) -> np.ndarray:
+        """Render a request against the bound room (runs in a worker thread)"""
+        if self.room is None:
+            raise ValueError("No room bound to this session")
+
+        mode = request.get("mode")
+        if mode not in RENDER_MODES:
+            raise ValueError(f"Unknown mode '{mode}', expected one of {RENDER_MODES}")
+        params = request.get("params", {})
+
+        result = None
+        if mode in ("floor-tiling", "floor-tiling-wall-coloring"):
+            if "floor_tile" not in self.tiles:
+                raise ValueError("No floor tile bound to this session")
+            floor = resolve_params(params, FLOOR_DEFAULTS)
+            result = self.render_cache.render_floor(
+                self.room, self.tiles["floor_tile"], floor["tiles_x"], floor["tiles_y"],
+                floor["grout_width"], floor["grout_color"]
+            )
+
+        if mode == "wall-tiling":
+            if "wall_tile" not in self.tiles:
+                raise ValueError("No wall tile bound to this session")
+            wall = resolve_params(params, WALL_DEFAULTS)
+            result = self.render_cache.render_wall_tiles(
+                self.room, self.tiles["wall_tile"], wall["tiles_x"], wall["tiles_y"],
+                wall["grout_width"], wall["grout_color"]
+            )
+
+        if mode in ("wall-coloring", "floor-tiling-wall-coloring"):
+            color = resolve_params(params, {}, required=("wall_color",))
+            result = self.render_cache.render_wall_color(self.room, color["wall_color"], base_np=result)
+
+        return result
+
+    async def render_loop(self):
+        """Render the latest queued request until the connection closes"""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            request, generation = self.latest, self.generation
+            request_id = request.get("id")
+
+            try:
+                # Reject unsupported formats before rendering, not after
+                format = str(request.get("format", "PNG")).upper()
+                if format not in IMAGE_FORMATS:
+                    raise ValueError(f"Unsupported format '{format}', expected one of {tuple(IMAGE_FORMATS)}")
+
+                result = await run_in_threadpool(self.render, request)
+                if self._is_stale(generation):
+                    self.skipped += 1
+                    continue
+
+                data = await run_in_threadpool(encode_image, result, format)
+                if self._is_stale(generation):
+                    self.skipped += 1
+                    continue
+
+                await self.send_frame({
+                    "type": "frame", "id": request_id, "mode": request.get("mode"),
+                    "format": format, "skipped": self.skipped
+                }, data)
+            except Exception as e:
+                await self.send_json({"type": "error", "id": request_id, "detail": f"Processing error: {str(e)}"})
@@ -1,16 +1,13 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
-import os
-import tempfile
-from PIL import Image
-import numpy as np
-import cv2
-import io
+import asyncio
 import base64
 from typing import Optional
-from room_tiler import CompleteRoomTiler
+from room_tiler import CompleteRoomTiler, hex_to_rgb, encode_image
+from render_cache import RenderCache
+from interactive import InteractiveSession
 
 app = FastAPI(
     title="Room Renovation API",
@@ -30,66 +27,13 @@ app.add_middleware(
 # Initialize the room tiler
 room_tiler = CompleteRoomTiler()
 
-def save_uploaded_file(upload_file: UploadFile) -> str:
-    """Save uploaded file to temporary location"""
-    suffix = os.path.splitext(upload_file.filename)[1]
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(upload_file.file.read())
-        return tmp.name
+# Cache room and tile layers so parameter-only changes skip segmentation and warping
+render_cache = RenderCache(room_tiler)
 
-def image_to_response(image: Image.Image, format: str = "PNG") -> Response:
-    """Convert PIL Image to FastAPI Response"""
-    img_io = io.BytesIO()
-    image.save(img_io, format=format, quality=95 if format == "JPEG" else None)
-    img_io.seek(0)
-    
+def image_to_response(image, format: str = "PNG") -> Response:
+    """Encode a uint8 RGB array (or PIL Image) into a FastAPI Response without copying the encoded buffer"""
     media_type = "image/png" if format == "PNG" else "image/jpeg"
-    return Response(content=img_io.read(), media_type=media_type)
-
-def hex_to_rgb(hex_color: str) -> tuple:
-    """Convert hex color to RGB tuple"""
-    hex_color = hex_color.lstrip('#')
-    if len(hex_color) != 6:
-        raise ValueError("Invalid hex color format")
-    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-
-def apply_wall_color(room_image_path: str, wall_color_hex: str) -> Image.Image:
-    """Apply solid color to walls"""
-    room_image = Image.open(room_image_path).convert("RGB")
-    
-    # Get wall mask
-    wall_mask = room_tiler.detect_wall_mask(room_image)
-    
-    if np.sum(wall_mask) == 0:
-        print("No walls detected, returning original image")
-        return room_image
-    
-    # Convert hex to RGB
-    wall_color_rgb = hex_to_rgb(wall_color_hex)
-    
-    # Create colored wall
-    room_np = np.array(room_image)
-    colored_room = room_np.copy().astype(np.float32)
-    
-    # Apply color to wall areas with blending
-    wall_mask_3ch = np.stack([wall_mask] * 3, axis=-1).astype(np.float32)
-    wall_mask_smooth = cv2.GaussianBlur(wall_mask_3ch, (5, 5), 0)
-    
-    # Create wall color array
-    wall_color_array = np.full_like(colored_room, wall_color_rgb, dtype=np.float32)
-    
-    # Blend with existing lighting
-    room_gray = cv2.cvtColor(room_np.astype(np.float32) / 255.0, cv2.COLOR_RGB2GRAY)
-    lighting = np.stack([room_gray] * 3, axis=-1)
-    lighting = np.clip(lighting * 1.1 + 0.4, 0.5, 1.2)
-    
-    # Apply lighting to wall color
-    lit_wall_color = np.clip((wall_color_array / 255.0) * lighting, 0, 1) * 255
-    
-    # Blend with original image
-    blended = wall_mask_smooth * lit_wall_color + (1 - wall_mask_smooth) * colored_room
-    
-    return Image.fromarray(np.clip(blended, 0, 255).astype(np.uint8))
+    return Response(content=encode_image(image, format), media_type=media_type)
 
 @app.post("/api/floor-tiling", 
           summary="Apply tiles to floor only",
@@ -103,39 +47,20 @@ async def floor_tiling(
     grout_color: str = Form("#F0EBE4", description="Grout color in hex format")
 ):
     try:
-        # Save uploaded files
-        room_path = save_uploaded_file(room_image)
-        floor_tile_path = save_uploaded_file(floor_tile)
+        # Convert hex grout color to RGB
+        grout_rgb = hex_to_rgb(grout_color)
+        
+        # Look up cached room layers (masks, lighting) by image content
+        room = render_cache.room(await room_image.read())
+        floor_tile_bytes = await floor_tile.read()
+        
+        # Only layers whose inputs changed are recomputed (e.g. grout color recolors cached grout)
+        final_result = render_cache.render_floor(
+            room, floor_tile_bytes, tiles_x, tiles_y, grout_width, grout_rgb
+        )
+        
+        return image_to_response(final_result)
         
-        try:
-            # Convert hex grout color to RGB
-            grout_rgb = hex_to_rgb(grout_color)
-            
-            # Load images
-            room_img = Image.open(room_path).convert("RGB")
-            floor_tile_img = Image.open(floor_tile_path).convert("RGB")
-            
-            room_width, room_height = room_img.size
-            
-            # Generate floor tiles
-            generated_floor = room_tiler.generate_floor_tiles(
-                floor_tile_img, room_width, room_height, 
-                tiles_x, tiles_y, grout_width, grout_rgb
-            )
-            
-            # Detect floor and apply
-            floor_mask = room_tiler.detect_floor_mask(room_img)
-            warped_floor = room_tiler.apply_perspective_to_floor(generated_floor, floor_mask, room_img)
-            final_result = room_tiler.blend_with_lighting(room_img, warped_floor, floor_mask, is_floor=True)
-            
-            result_image = Image.fromarray(final_result)
-            return image_to_response(result_image)
-            
-        finally:
-            # Clean up temporary files
-            os.unlink(room_path)
-            os.unlink(floor_tile_path)
-            
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
@@ -156,50 +81,28 @@ async def complete_tiling(
     wall_grout_color: str = Form("#F5F0EB", description="Wall grout color in hex")
 ):
     try:
-        # Save uploaded files
-        room_path = save_uploaded_file(room_image)
-        floor_tile_path = save_uploaded_file(floor_tile)
-        wall_tile_path = save_uploaded_file(wall_tile)
+        # Convert hex colors to RGB
+        floor_grout_rgb = hex_to_rgb(floor_grout_color)
+        wall_grout_rgb = hex_to_rgb(wall_grout_color)
+        
+        # Look up cached room layers (masks, lighting, mattes) by image content
+        room = render_cache.room(await room_image.read())
+        floor_tile_bytes = await floor_tile.read()
+        wall_tile_bytes = await wall_tile.read()
+        
+        # Step 1: Apply floor tiling
+        room_with_floor = render_cache.render_floor(
+            room, floor_tile_bytes, floor_tiles_x, floor_tiles_y, floor_grout_width, floor_grout_rgb
+        )
+        
+        # Step 2: Apply wall tiling to the result, using walls detected in the original room
+        final_result = render_cache.render_wall_tiles(
+            room, wall_tile_bytes, wall_tiles_x, wall_tiles_y, wall_grout_width, wall_grout_rgb,
+            base_np=room_with_floor
+        )
+        
+        return image_to_response(final_result)
         
-        try:
-            # Convert hex colors to RGB
-            floor_grout_rgb = hex_to_rgb(floor_grout_color)
-            wall_grout_rgb = hex_to_rgb(wall_grout_color)
-            
-            # Create temporary output path
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-                output_path = tmp.name
-            
-            try:
-                # Process complete renovation
-                result_image = room_tiler.replace_room_floor_and_walls(
-                    room_image_path=room_path,
-                    floor_tile_path=floor_tile_path,
-                    wall_tile_path=wall_tile_path,
-                    output_image_path=output_path,
-                    floor_tiles_x=floor_tiles_x,
-                    floor_tiles_y=floor_tiles_y,
-                    floor_grout_width=floor_grout_width,
-                    floor_grout_color=floor_grout_rgb,
-                    wall_tiles_x=wall_tiles_x,
-                    wall_tiles_y=wall_tiles_y,
-                    wall_grout_width=wall_grout_width,
-                    wall_grout_color=wall_grout_rgb
-                )
-                
-                return image_to_response(result_image)
-                
-            finally:
-                # Clean up output file
-                if os.path.exists(output_path):
-                    os.unlink(output_path)
-            
-        finally:
-            # Clean up temporary files
-            os.unlink(room_path)
-            os.unlink(floor_tile_path)
-            os.unlink(wall_tile_path)
-            
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
@@ -215,39 +118,20 @@ async def wall_tiling(
     grout_color: str = Form("#F5F0EB", description="Grout color in hex format")
 ):
     try:
-        # Save uploaded files
-        room_path = save_uploaded_file(room_image)
-        wall_tile_path = save_uploaded_file(wall_tile)
+        # Convert hex grout color to RGB
+        grout_rgb = hex_to_rgb(grout_color)
+        
+        # Look up cached room layers (masks, lighting) by image content
+        room = render_cache.room(await room_image.read())
+        wall_tile_bytes = await wall_tile.read()
+        
+        # Only layers whose inputs changed are recomputed
+        final_result = render_cache.render_wall_tiles(
+            room, wall_tile_bytes, tiles_x, tiles_y, grout_width, grout_rgb
+        )
+        
+        return image_to_response(final_result)
         
-        try:
-            # Convert hex grout color to RGB
-            grout_rgb = hex_to_rgb(grout_color)
-            
-            # Load images
-            room_img = Image.open(room_path).convert("RGB")
-            wall_tile_img = Image.open(wall_tile_path).convert("RGB")
-            
-            room_width, room_height = room_img.size
-            
-            # Generate wall tiles
-            generated_wall = room_tiler.generate_wall_tiles(
-                wall_tile_img, room_width, room_height,
-                tiles_x, tiles_y, grout_width, grout_rgb
-            )
-            
-            # Detect walls and apply
-            wall_mask = room_tiler.detect_wall_mask(room_img)
-            wall_texture = room_tiler.apply_wall_texture(generated_wall, wall_mask)
-            final_result = room_tiler.blend_with_lighting(room_img, wall_texture, wall_mask, is_floor=False)
-            
-            result_image = Image.fromarray(final_result)
-            return image_to_response(result_image)
-            
-        finally:
-            # Clean up temporary files
-            os.unlink(room_path)
-            os.unlink(wall_tile_path)
-            
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
@@ -259,18 +143,15 @@ async def wall_coloring(
     wall_color: str = Form(..., description="Wall color in hex format (e.g., #FF5733)")
 ):
     try:
-        # Save uploaded file
-        room_path = save_uploaded_file(room_image)
+        # Convert hex to RGB
+        wall_color_rgb = hex_to_rgb(wall_color)
+        
+        # Recomposite with the room's cached lighting and wall matte
+        room = render_cache.room(await room_image.read())
+        final_result = render_cache.render_wall_color(room, wall_color_rgb)
+        
+        return image_to_response(final_result)
         
-        try:
-            # Apply wall color
-            result_image = apply_wall_color(room_path, wall_color)
-            return image_to_response(result_image)
-            
-        finally:
-            # Clean up temporary file
-            os.unlink(room_path)
-            
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
@@ -287,52 +168,46 @@ async def floor_tiling_wall_coloring(
     grout_color: str = Form("#F0EBE4", description="Floor grout color in hex format")
 ):
     try:
-        # Save uploaded files
-        room_path = save_uploaded_file(room_image)
-        floor_tile_path = save_uploaded_file(floor_tile)
+        # Convert hex colors to RGB
+        grout_rgb = hex_to_rgb(grout_color)
+        wall_color_rgb = hex_to_rgb(wall_color)
+        
+        # Look up cached room layers (masks, lighting) by image content
+        room = render_cache.room(await room_image.read())
+        floor_tile_bytes = await floor_tile.read()
+        
+        # Step 1: Apply floor tiling
+        room_with_floor = render_cache.render_floor(
+            room, floor_tile_bytes, tiles_x, tiles_y, grout_width, grout_rgb
+        )
+        
+        # Step 2: Apply wall coloring to the result, using walls detected in the original room
+        final_result = render_cache.render_wall_color(room, wall_color_rgb, base_np=room_with_floor)
+        
+        return image_to_response(final_result)
         
-        try:
-            # Convert hex grout color to RGB
-            grout_rgb = hex_to_rgb(grout_color)
-            
-            # Load images
-            room_img = Image.open(room_path).convert("RGB")
-            floor_tile_img = Image.open(floor_tile_path).convert("RGB")
-            
-            room_width, room_height = room_img.size
-            
-            # Step 1: Apply floor tiling
-            generated_floor = room_tiler.generate_floor_tiles(
-                floor_tile_img, room_width, room_height, 
-                tiles_x, tiles_y, grout_width, grout_rgb
-            )
-            
-            floor_mask = room_tiler.detect_floor_mask(room_img)
-            warped_floor = room_tiler.apply_perspective_to_floor(generated_floor, floor_mask, room_img)
-            room_with_floor = room_tiler.blend_with_lighting(room_img, warped_floor, floor_mask, is_floor=True)
-            
-            # Step 2: Apply wall coloring to the result
-            room_with_floor_img = Image.fromarray(room_with_floor)
-            
-            # Save temporary image for wall coloring
-            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-                temp_room_path = tmp.name
-                room_with_floor_img.save(temp_room_path)
-            
-            try:
-                final_result = apply_wall_color(temp_room_path, wall_color)
-                return image_to_response(final_result)
-            finally:
-                os.unlink(temp_room_path)
-            
-        finally:
-            # Clean up temporary files
-            os.unlink(room_path)
-            os.unlink(floor_tile_path)
-            
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
+@app.websocket("/ws/interactive")
+async def interactive_editing(websocket: WebSocket):
+    """Interactive editing channel: bind a room, stream parameter updates, receive the latest frame"""
+    await websocket.accept()
+    session = InteractiveSession(websocket, render_cache)
+    render_task = asyncio.create_task(session.render_loop())
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            # Malformed or binary messages get an error reply instead of closing the channel
+            await session.receive(message.get("text"))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        render_task.cancel()
+
 @app.get("/", summary="API Status", description="Check if the API is running")
 async def root():
     return {
@@ -343,7 +218,8 @@ async def root():
             "complete_tiling": "/api/complete-tiling", 
             "wall_tiling": "/api/wall-tiling",
             "wall_coloring": "/api/wall-coloring",
-            "floor_tiling_wall_coloring": "/api/floor-tiling-wall-coloring"
+            "floor_tiling_wall_coloring": "/api/floor-tiling-wall-coloring",
+            "interactive": "/ws/interactive"
         }
     }
 
@@ -0,0 +1,215 @@
+"""
+Per-room layer cache for incremental re-rendering.
+
+Rooms are keyed by a hash of their uploaded bytes. The masks, lighting and
+alpha mattes of a room are computed once, on first use, and kept in a
+RoomLayers entry. Tile patterns are split into a warped tile layer and a grout
+alpha layer, so later requests that change only the grout color or the wall
+color are recomposited from cached layers without segmentation, tile
+generation or warping. Because the layers are warped before the grout color is
+added, resampling overshoot is clipped after the warp rather than before it;
+floors can therefore differ from CompleteRoomTiler's direct path by a few
+levels along tile edges and highlights.
+"""
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from room_tiler import as_rgb_array
+
+# Memory caps for cached layers; rooms hold ~25 bytes/pixel once every layer is computed
+DEFAULT_ROOM_CACHE_MB = 768
+DEFAULT_TILE_CACHE_MB = 256
+
+
+def content_key(data: bytes) -> str:
+    """Stable cache key for uploaded file contents"""
+    return hashlib.sha1(data).hexdigest()
+
+
+def nbytes(value) -> int:
+    """Memory held by a cached array, tuple of arrays or RoomLayers"""
+    if isinstance(value, tuple):
+        return sum(nbytes(item) for item in value)
+    return value.nbytes
+
+
+class LRUCache:
+    """Thread-safe LRU mapping bounded by the total size of its entries"""
+
+    def __init__(self, max_bytes: int, size_of: Callable = nbytes):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        # Entries may grow after insertion (lazy room layers), so sizes are re-measured;
+        # the most recently used entry is always kept
+        total = sum(self.size_of(value) for value in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            _, value = self._entries.popitem(last=False)
+            total -= self.size_of(value)
+
+    def get_or_create(self, key, create: Callable):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._evict()
+                return self._entries[key]
+
+        # Build outside the lock so slow entries do not block other rooms
+        value = create()
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._entries[key] = value
+            self._evict()
+            return value
+
+
+class RoomLayers:
+    """Decoded room image plus lazily computed, reusable per-room layers"""
+
+    def __init__(self, key: str, room_np: np.ndarray, tiler):
+        self.key = key
+        self.room_np = room_np
+        self.tiler = tiler
+        self._layers = {}
+        # Re-entrant: mattes are computed from masks through the same lock
+        self._lock = threading.RLock()
+
+    @property
+    def width(self) -> int:
+        return self.room_np.shape[1]
+
+    @property
+    def height(self) -> int:
+        return self.room_np.shape[0]
+
+    def _layer(self, name: str, compute: Callable):
+        # Layers are computed at most once per room; the lock also serializes model inference
+        with self._lock:
+            if name not in self._layers:
+                self._layers[name] = compute()
+            return self._layers[name]
+
+    @property
+    def floor_mask(self) -> np.ndarray:
+        return self._layer("floor_mask", lambda: self.tiler.detect_floor_mask(self.room_np))
+
+    @property
+    def wall_mask(self) -> np.ndarray:
+        return self._layer("wall_mask", lambda: self.tiler.detect_wall_mask(self.room_np))
+
+    @property
+    def floor_lighting(self) -> np.ndarray:
+        return self._layer("floor_lighting", lambda: self.tiler.extract_lighting(self.room_np, is_floor=True))
+
+    @property
+    def wall_lighting(self) -> np.ndarray:
+        return self._layer("wall_lighting", lambda: self.tiler.extract_lighting(self.room_np, is_floor=False))
+
+    @property
+    def color_lighting(self) -> np.ndarray:
+        return self._layer("color_lighting", lambda: self.tiler.extract_color_lighting(self.room_np))
+
+    @property
+    def floor_alpha(self) -> np.ndarray:
+        return self._layer("floor_alpha", lambda: self.tiler.refine_mask(self.floor_mask, self.room_np))
+
+    @property
+    def wall_alpha(self) -> np.ndarray:
+        return self._layer("wall_alpha", lambda: self.tiler.refine_mask(self.wall_mask, self.room_np))
+
+    @property
+    def has_walls(self) -> bool:
+        return bool(np.any(self.wall_mask))
+
+    @property
+    def nbytes(self) -> int:
+        # Read without the layer lock, which may be held for the whole of a model pass
+        return self.room_np.nbytes + sum(layer.nbytes for layer in list(self._layers.values()))
+
+
+class RenderCache:
+    """Renders floors and walls from cached room and tile layers"""
+
+    def __init__(self, tiler, room_cache_mb: int = DEFAULT_ROOM_CACHE_MB,
+                 tile_cache_mb: int = DEFAULT_TILE_CACHE_MB):
+        self.tiler = tiler
+        self.rooms = LRUCache(room_cache_mb * 1024 * 1024)
+        self.tile_layers = LRUCache(tile_cache_mb * 1024 * 1024)
+
+    def room(self, room_bytes: bytes) -> RoomLayers:
+        """Get the cached layers for a room, decoding it on first use"""
+        key = content_key(room_bytes)
+
+        def create():
+            print(f"Caching new room {key[:12]}")
+            room_np = as_rgb_array(Image.open(io.BytesIO(room_bytes)))
+            return RoomLayers(key, room_np, self.tiler)
+
+        return self.rooms.get_or_create(key, create)
+
+    def _surface_layers(self, room: RoomLayers, tile_bytes: bytes, is_floor: bool,
+                        tiles_x: int, tiles_y: int, grout_width: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the cached tile and grout layers of a surface, generating and warping them on first use"""
+        surface = "floor" if is_floor else "wall"
+        key = (room.key, surface, content_key(tile_bytes), tiles_x, tiles_y, grout_width)
+
+        def create():
+            tile_image = Image.open(io.BytesIO(tile_bytes)).convert("RGB")
+            tiles_np, grout_alpha = self.tiler.generate_tile_layers(
+                tile_image, room.width, room.height, tiles_x, tiles_y, grout_width,
+                min_tile_size=10 if is_floor else 8
+            )
+            if not is_floor:
+                return tiles_np, grout_alpha
+
+            # Warp both layers identically so grout can be recolored after perspective
+            return (
+                self.tiler.apply_perspective_to_floor(tiles_np, room.floor_mask, room.room_np),
+                self.tiler.apply_perspective_to_floor(grout_alpha, room.floor_mask, room.room_np),
+            )
+
+        return self.tile_layers.get_or_create(key, create)
+
+    def render_floor(self, room: RoomLayers, tile_bytes: bytes, tiles_x: int, tiles_y: int,
+                     grout_width: int, grout_color: tuple,
+                     base_np: Optional[np.ndarray] = None) -> np.ndarray:
+        """Tile the floor of a room, recomputing only layers whose inputs changed"""
+        tiles_np, grout_alpha = self._surface_layers(room, tile_bytes, True, tiles_x, tiles_y, grout_width)
+        floor_np = self.tiler.apply_grout_color(tiles_np, grout_alpha, grout_color)
+        base_np = room.room_np if base_np is None else base_np
+        return self.tiler.composite_surface(base_np, floor_np, room.floor_lighting, room.floor_alpha)
+
+    def render_wall_tiles(self, room: RoomLayers, tile_bytes: bytes, tiles_x: int, tiles_y: int,
+                          grout_width: int, grout_color: tuple,
+                          base_np: Optional[np.ndarray] = None) -> np.ndarray:
+        """Tile the walls of a room, recomputing only layers whose inputs changed"""
+        base_np = room.room_np if base_np is None else base_np
+        if not room.has_walls:
+            print("No walls detected, returning original image")
+            return base_np
+
+        tiles_np, grout_alpha = self._surface_layers(room, tile_bytes, False, tiles_x, tiles_y, grout_width)
+        wall_np = self.tiler.apply_grout_color(tiles_np, grout_alpha, grout_color)
+        return self.tiler.composite_surface(base_np, wall_np, room.wall_lighting, room.wall_alpha)
+
+    def render_wall_color(self, room: RoomLayers, wall_color: tuple,
+                          base_np: Optional[np.ndarray] = None) -> np.ndarray:
+        """Paint the walls of a room using its cached lighting and wall matte"""
+        base_np = room.room_np if base_np is None else base_np
+        if not room.has_walls:
+            print("No walls detected, returning original image")
+            return base_np
+
+        return self.tiler.composite_color(base_np, wall_color, room.color_lighting, room.wall_alpha)
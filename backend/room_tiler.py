@@ -2,23 +2,83 @@ import torch
 import numpy as np
 import cv2
 from PIL import Image
+import io
 import os
 import math
 from torchvision import transforms
 from transformers import SegformerForSemanticSegmentation, AutoImageProcessor, Mask2FormerForUniversalSegmentation
 import warnings
 from typing import Tuple, Optional
+from tiled_processing import (
+    DEFAULT_CHUNK_MEMORY_MB,
+    default_workers, plan_strips, run_strips
+)
 warnings.filterwarnings("ignore")
 
+# Rows of context each strip needs so the 15x15 lighting blur matches full-frame output
+LIGHTING_HALO = 7
+# Approximate float32 working set per pixel of a lighting blend
+BLEND_BYTES_PER_PIXEL = 160
+# Approximate working set per pixel of a perspective warp
+WARP_BYTES_PER_PIXEL = 16
+
+# Guided-filter matte settings: longest side of the working resolution,
+# soft-edge radius (in full-resolution pixels) and edge-preservation regularizer
+MATTE_MAX_SIDE = 640
+MATTE_RADIUS = 4
+MATTE_EPS = 1e-3
+
+# Encoded output formats: OpenCV extension and encoder parameters
+IMAGE_FORMATS = {
+    "PNG": (".png", [cv2.IMWRITE_PNG_COMPRESSION, 6]),
+    "JPEG": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, 95]),
+}
+
+def hex_to_rgb(hex_color: str) -> tuple:
+    """Convert hex color to RGB tuple"""
+    hex_color = hex_color.lstrip('#')
+    if len(hex_color) != 6:
+        raise ValueError("Invalid hex color format")
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+def as_rgb_array(image) -> np.ndarray:
+    """Canonical pipeline image: C-contiguous uint8 RGB array (returned as-is if it already is one)"""
+    if isinstance(image, Image.Image):
+        image = np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+    return np.ascontiguousarray(image, dtype=np.uint8)
+
+def encode_image(image, format: str = "PNG") -> memoryview:
+    """Encode a pipeline image, returning a view of the encoder's output buffer (no extra copy)"""
+    if format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format '{format}', expected one of {tuple(IMAGE_FORMATS)}")
+    image_np = as_rgb_array(image)
+    extension, params = IMAGE_FORMATS[format]
+    
+    ok, buffer = cv2.imencode(extension, cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"Could not encode image as {format}")
+    return memoryview(buffer.reshape(-1))
+
 class CompleteRoomTiler:
-    def __init__(self):
+    def __init__(self, chunk_memory_mb=DEFAULT_CHUNK_MEMORY_MB, chunk_workers=None,
+                 load_models=True):
+        """
+        Args:
+            chunk_memory_mb (int): Working memory budget; stages whose full-frame working set
+                would exceed it are rendered in strips (None disables chunked rendering)
+            chunk_workers (int): Threads used for strip rendering (defaults to CPU count, max 8)
+            load_models (bool): Load segmentation models (render-only workers skip this)
+        """
+        self.chunk_memory_mb = chunk_memory_mb
+        self.chunk_workers = chunk_workers or default_workers()
         self.device = self._get_device()
         self.processor = None
         self.model = None
         self.wall_processor = None
         self.wall_model = None
         self.wall_support = False
-        self._load_models()
+        if load_models:
+            self._load_models()
     
     def _get_device(self):
         if torch.cuda.is_available():
@@ -95,9 +155,36 @@ class CompleteRoomTiler:
             print(f"Warning: Could not load wall segmentation model: {e}")
             self.wall_support = False
 
+    def _use_chunked(self, height, width, bytes_per_pixel):
+        """Check whether a stage's full-frame working set would exceed the memory budget"""
+        if self.chunk_memory_mb is None:
+            return False
+        return height * width * bytes_per_pixel > self.chunk_memory_mb * 1024 * 1024
+
+    def _run_chunked(self, height, width, halo, bytes_per_pixel, process_strip):
+        """Run a strip processor over the image within the configured memory budget"""
+        strips, workers = plan_strips(height, width, halo, bytes_per_pixel,
+                                      self.chunk_memory_mb, self.chunk_workers)
+        print(f"Chunked rendering: {len(strips)} strips on {workers} workers")
+        run_strips(strips, process_strip, workers)
+
+    def _render_rows(self, shape, dtype, halo, render_region, bytes_per_pixel=BLEND_BYTES_PER_PIXEL):
+        """Render a full-frame array from render_region(y0, y1), in strips when its working set exceeds the budget"""
+        height, width = shape[:2]
+        if not self._use_chunked(height, width, bytes_per_pixel):
+            return render_region(0, height)
+        
+        result = np.empty(shape, dtype=dtype)
+        
+        def render_strip(y0, y1, halo_y0, halo_y1):
+            result[y0:y1] = render_region(halo_y0, halo_y1)[y0 - halo_y0:y1 - halo_y0]
+        
+        self._run_chunked(height, width, halo, bytes_per_pixel, render_strip)
+        return result
+
     def generate_floor_tiles(self, tile_image, room_width, room_height, tiles_x=25, tiles_y=18, 
                            grout_width=2, grout_color=(240, 235, 228)):
-        """Generate floor tile pattern sized for room dimensions"""
+        """Generate floor tile pattern sized for room dimensions (as a uint8 RGB array)"""
         print(f"Generating floor tiles: {tiles_x}x{tiles_y}")
         
         # Calculate tile size
@@ -127,11 +214,11 @@ class CompleteRoomTiler:
         if floor_width != room_width or floor_height != room_height:
             floor_image = floor_image.resize((room_width, room_height), Image.Resampling.LANCZOS)
         
-        return floor_image
+        return as_rgb_array(floor_image)
 
     def generate_wall_tiles(self, tile_image, room_width, room_height, tiles_x=20, tiles_y=15, 
                           grout_width=2, grout_color=(245, 240, 235)):
-        """Generate wall tile pattern - usually smaller tiles than floor"""
+        """Generate wall tile pattern (as a uint8 RGB array) - usually smaller tiles than floor"""
         print(f"Generating wall tiles: {tiles_x}x{tiles_y}")
         
         # Calculate tile size for wall
@@ -161,23 +248,70 @@ class CompleteRoomTiler:
         if wall_width != room_width or wall_height != room_height:
             wall_image = wall_image.resize((room_width, room_height), Image.Resampling.LANCZOS)
         
-        return wall_image
+        return as_rgb_array(wall_image)
 
-    def detect_floor_mask(self, room_image):
-        """Detect floor areas using SegFormer"""
-        print("Detecting floor areas...")
+    def generate_tile_layers(self, tile_image, room_width, room_height, tiles_x, tiles_y,
+                             grout_width=2, min_tile_size=10):
+        """
+        Generate a tile pattern with black grout (int16) plus a grout alpha layer.
         
-        room_np = np.array(room_image)
+        Resizing is linear, so apply_grout_color(tiles, grout_alpha, color) reproduces
+        the generate_floor_tiles/generate_wall_tiles pattern for any grout color
+        without regenerating it.
+        """
+        print(f"Generating tile layers: {tiles_x}x{tiles_y}")
         
-        # Run floor segmentation
-        inputs = self.processor(images=room_image, return_tensors="pt").to(self.device)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
+        # Calculate tile size
+        available_width = room_width - (grout_width * (tiles_x + 1))
+        available_height = room_height - (grout_width * (tiles_y + 1))
+        
+        tile_width = max(available_width // tiles_x, min_tile_size)
+        tile_height = max(available_height // tiles_y, min_tile_size)
+        
+        # Resize tile
+        optimized_tile = tile_image.resize((tile_width, tile_height), Image.Resampling.LANCZOS)
+        tile_hole = Image.new('L', (tile_width, tile_height), 0)
+        
+        # Create tile and grout layers
+        pattern_width = (tile_width * tiles_x) + (grout_width * (tiles_x + 1))
+        pattern_height = (tile_height * tiles_y) + (grout_width * (tiles_y + 1))
         
-        segmentation = outputs.logits.argmax(dim=1).squeeze().cpu().numpy()
+        tiles_image = Image.new('RGB', (pattern_width, pattern_height), (0, 0, 0))
+        grout_image = Image.new('L', (pattern_width, pattern_height), 255)
+        
+        # Place tiles
+        for y in range(tiles_y):
+            for x in range(tiles_x):
+                paste_x = grout_width + (x * (tile_width + grout_width))
+                paste_y = grout_width + (y * (tile_height + grout_width))
+                tiles_image.paste(optimized_tile, (paste_x, paste_y))
+                grout_image.paste(tile_hole, (paste_x, paste_y))
+        
+        if pattern_width == room_width and pattern_height == room_height:
+            return np.array(tiles_image).astype(np.int16), np.array(grout_image).astype(np.float32) / 255.0
+        
+        # Resize to exact room dimensions in float mode, keeping the LANCZOS overshoot
+        # that would otherwise be clipped before the grout color is added back
+        def resize_float(channel_image):
+            return np.array(channel_image.convert('F').resize((room_width, room_height), Image.Resampling.LANCZOS))
+        
+        tiles_np = np.stack([resize_float(channel) for channel in tiles_image.split()], axis=-1)
+        grout_alpha = resize_float(grout_image) / 255.0
+        return np.rint(tiles_np).astype(np.int16), grout_alpha
+
+    def apply_grout_color(self, tiles_np, grout_alpha, grout_color):
+        """Fill the grout of a tile layer with a color"""
+        def render_region(y0, y1):
+            grout = grout_alpha[y0:y1, :, np.newaxis] * np.array(grout_color, dtype=np.float32)
+            return np.clip(tiles_np[y0:y1] + grout, 0, 255).astype(np.uint8)
+        
+        return self._render_rows(tiles_np.shape, np.uint8, 0, render_region)
+
+    def _refine_floor_mask(self, segmentation, width, height):
+        """Turn a SegFormer label map into a clean floor mask at image size"""
         segmentation_resized = cv2.resize(
             segmentation.astype(np.uint8), 
-            (room_np.shape[1], room_np.shape[0]), 
+            (width, height), 
             interpolation=cv2.INTER_NEAREST
         )
         
@@ -192,29 +326,8 @@ class CompleteRoomTiler:
         print(f"Floor mask created: {np.sum(floor_mask)} floor pixels")
         return floor_mask
 
-    def detect_wall_mask(self, room_image):
-        """Detect wall areas using Mask2Former"""
-        if not self.wall_support:
-            print("Wall detection not available")
-            return np.zeros((room_image.height, room_image.width), dtype=np.uint8)
-        
-        print("Detecting wall areas...")
-        
-        # Convert to RGB
-        image_rgb = room_image.convert("RGB")
-        
-        # Perform wall segmentation
-        inputs = self.wall_processor(images=image_rgb, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            outputs = self.wall_model(**inputs)
-        
-        # Get segmentation map
-        segmentation = self.wall_processor.post_process_semantic_segmentation(
-            outputs, target_sizes=[image_rgb.size[::-1]]
-        )[0].cpu().numpy()
-        
+    def _refine_wall_mask(self, segmentation, width, height):
+        """Turn a Mask2Former label map into a mask of all significant walls"""
         # Find walls (class 0 in ADE20K)
         wall_mask = (segmentation == 0).astype(np.uint8)
         
@@ -224,7 +337,7 @@ class CompleteRoomTiler:
             
             if num_labels > 1:
                 # Get all significant walls (not just the largest)
-                min_area = image_rgb.width * image_rgb.height * 0.02  # At least 2% of image
+                min_area = width * height * 0.02  # At least 2% of image
                 wall_mask = np.zeros_like(wall_mask)
                 
                 for i in range(1, num_labels):
@@ -235,20 +348,74 @@ class CompleteRoomTiler:
                 kernel = np.ones((5, 5), np.uint8)
                 wall_mask = cv2.morphologyEx(wall_mask, cv2.MORPH_CLOSE, kernel)
                 wall_mask = cv2.morphologyEx(wall_mask, cv2.MORPH_OPEN, kernel)
-                
-                # Smooth edges
-                wall_mask = cv2.GaussianBlur(wall_mask.astype(np.float32), (3, 3), 0)
-                wall_mask = (wall_mask > 0.5).astype(np.uint8)
         
         print(f"Wall mask created: {np.sum(wall_mask)} wall pixels")
         return wall_mask
 
+    def detect_floor_mask(self, room_image):
+        """Detect floor areas using SegFormer"""
+        return self.detect_floor_masks([room_image])[0]
+
+    def detect_floor_masks(self, room_images):
+        """Detect floor areas for a batch of room images in one SegFormer pass"""
+        print(f"Detecting floor areas in {len(room_images)} image(s)...")
+        
+        room_arrays = [as_rgb_array(room_image) for room_image in room_images]
+        
+        # Run floor segmentation
+        inputs = self.processor(images=room_arrays, return_tensors="pt").to(self.device)
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        
+        segmentations = outputs.logits.argmax(dim=1).cpu().numpy()
+        return [
+            self._refine_floor_mask(segmentation, room_np.shape[1], room_np.shape[0])
+            for segmentation, room_np in zip(segmentations, room_arrays)
+        ]
+
+    def detect_wall_mask(self, room_image):
+        """Detect wall areas using Mask2Former"""
+        return self.detect_wall_masks([room_image])[0]
+
+    def detect_wall_masks(self, room_images):
+        """Detect wall areas for a batch of room images in one Mask2Former pass"""
+        room_arrays = [as_rgb_array(room_image) for room_image in room_images]
+        
+        if not self.wall_support:
+            print("Wall detection not available")
+            return [np.zeros(room_np.shape[:2], dtype=np.uint8) for room_np in room_arrays]
+        
+        print(f"Detecting wall areas in {len(room_images)} image(s)...")
+        
+        # Mask2Former pads mixed-size batches to the largest image and post-processing
+        # would stretch the padded logits, so only same-size rooms share a pass
+        groups = {}
+        for index, room_np in enumerate(room_arrays):
+            groups.setdefault(room_np.shape[:2], []).append(index)
+        
+        wall_masks = [None] * len(room_arrays)
+        for (height, width), indices in groups.items():
+            # Perform wall segmentation
+            inputs = self.wall_processor(images=[room_arrays[i] for i in indices], return_tensors="pt")
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+            
+            with torch.no_grad():
+                outputs = self.wall_model(**inputs)
+            
+            # Get segmentation maps
+            segmentations = self.wall_processor.post_process_semantic_segmentation(
+                outputs, target_sizes=[(height, width)] * len(indices)
+            )
+            for i, segmentation in zip(indices, segmentations):
+                wall_masks[i] = self._refine_wall_mask(segmentation.cpu().numpy(), width, height)
+        return wall_masks
+
     def apply_perspective_to_floor(self, floor_image, mask, room_image):
         """Apply perspective transformation to floor"""
         print("Applying floor perspective...")
         
-        room_np = np.array(room_image)
-        floor_np = np.array(floor_image)
+        room_np = as_rgb_array(room_image)
+        floor_np = np.asarray(floor_image)
         
         # Find floor contours
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -278,54 +445,203 @@ class CompleteRoomTiler:
         ], dtype=np.float32)
         
         H = cv2.getPerspectiveTransform(src_pts, dst_pts)
-        warped_floor = cv2.warpPerspective(floor_np, H, (room_np.shape[1], room_np.shape[0]))
+        room_height, room_width = room_np.shape[:2]
+        
+        if not self._use_chunked(room_height, room_width, WARP_BYTES_PER_PIXEL):
+            return cv2.warpPerspective(floor_np, H, (room_width, room_height))
+        
+        # Warp each output strip separately by shifting the destination origin
+        warped_floor = np.empty((room_height, room_width) + floor_np.shape[2:], dtype=floor_np.dtype)
+        
+        def warp_strip(y0, y1, halo_y0, halo_y1):
+            shift = np.array([[1, 0, 0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+            cv2.warpPerspective(floor_np, shift @ H, (room_width, y1 - y0),
+                                dst=warped_floor[y0:y1])
         
+        self._run_chunked(room_height, room_width, 0, WARP_BYTES_PER_PIXEL, warp_strip)
         return warped_floor
 
     def apply_wall_texture(self, wall_image, mask):
         """Apply wall texture to wall areas - no perspective needed for walls"""
         print("Applying wall texture...")
         
-        wall_np = np.array(wall_image)
+        wall_np = as_rgb_array(wall_image)
         
         # For walls, we typically don't need perspective transformation
         # Walls are usually vertical surfaces that can use the texture directly
         return wall_np
 
-    def blend_with_lighting(self, room_image, textured_surface, mask, is_floor=True):
-        """Blend textured surface with room lighting"""
-        blend_type = "floor" if is_floor else "wall"
-        print(f"Blending {blend_type} with room lighting...")
-        
-        room_np = np.array(room_image)
-        room_float = room_np.astype(np.float32) / 255.0
-        surface_float = textured_surface.astype(np.float32) / 255.0
-        
-        # Extract lighting from room
-        room_gray = cv2.cvtColor(room_float, cv2.COLOR_RGB2GRAY)
+    def _lighting_region(self, room_np, is_floor):
+        """Extract the lighting multiplier for a room region"""
+        room_gray = cv2.cvtColor(room_np.astype(np.float32) / 255.0, cv2.COLOR_RGB2GRAY)
         room_gray_smooth = cv2.GaussianBlur(room_gray, (15, 15), 0)
         
         # Different lighting adjustments for floor vs wall
         if is_floor:
-            lighting = np.stack([room_gray_smooth] * 3, axis=-1)
-            lighting = np.clip(lighting * 1.2 + 0.3, 0.4, 1.3)
-        else:  # wall
-            lighting = np.stack([room_gray_smooth] * 3, axis=-1) 
-            lighting = np.clip(lighting * 1.1 + 0.4, 0.5, 1.2)  # Slightly different for walls
+            return np.clip(room_gray_smooth * 1.2 + 0.3, 0.4, 1.3)
+        return np.clip(room_gray_smooth * 1.1 + 0.4, 0.5, 1.2)  # Slightly different for walls
+
+    def extract_lighting(self, room_image, is_floor=True):
+        """Extract a single-channel lighting multiplier from the room for textured surfaces"""
+        room_np = as_rgb_array(room_image)
+        return self._render_rows(
+            room_np.shape[:2], np.float32, LIGHTING_HALO,
+            lambda y0, y1: self._lighting_region(room_np[y0:y1], is_floor)
+        )
+
+    def _color_lighting_region(self, room_np):
+        """Extract the lighting multiplier for solid colors (unsmoothed, keeps wall detail)"""
+        room_gray = cv2.cvtColor(room_np.astype(np.float32) / 255.0, cv2.COLOR_RGB2GRAY)
+        return np.clip(room_gray * 1.1 + 0.4, 0.5, 1.2)
+
+    def extract_color_lighting(self, room_image):
+        """Extract a single-channel lighting multiplier from the room for solid wall colors"""
+        room_np = as_rgb_array(room_image)
         
-        # Apply lighting
-        lit_surface = np.clip(surface_float * lighting, 0, 1)
+        return self._render_rows(
+            room_np.shape[:2], np.float32, 0,
+            lambda y0, y1: self._color_lighting_region(room_np[y0:y1])
+        )
+
+    def refine_mask(self, mask, room_image, max_side=MATTE_MAX_SIDE, radius=MATTE_RADIUS, eps=MATTE_EPS):
+        """
+        Refine a binary mask into a single-channel float alpha matte.
+        
+        A guided filter with the room as guide runs at reduced resolution; its
+        linear coefficients are upsampled and applied to the full-resolution
+        guide, so matte edges follow image edges at a fraction of the cost.
+        The radius is in full-resolution pixels: within that distance of the
+        mask edge the matte fades from the filter output back to the mask, so
+        the soft transition stays continuous and its width does not grow with
+        the input size.
+        """
+        print("Refining mask into alpha matte...")
+        
+        room_np = as_rgb_array(room_image)
+        height, width = mask.shape[:2]
+        scale = min(1.0, max_side / max(height, width))
+        small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        
+        # Guide and mask at working resolution
+        guide = cv2.cvtColor(cv2.resize(room_np, small_size, interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        guide = guide.astype(np.float32) / 255.0
+        mask_small = cv2.resize(mask.astype(np.float32), small_size, interpolation=cv2.INTER_AREA)
+        
+        # Guided filter coefficients (q = a * I + b within each window)
+        small_radius = max(1, round(radius * scale))
+        window = (2 * small_radius + 1, 2 * small_radius + 1)
+        mean_guide = cv2.boxFilter(guide, -1, window)
+        mean_mask = cv2.boxFilter(mask_small, -1, window)
+        cov_guide_mask = cv2.boxFilter(guide * mask_small, -1, window) - mean_guide * mean_mask
+        var_guide = cv2.boxFilter(guide * guide, -1, window) - mean_guide * mean_guide
+        
+        a = cov_guide_mask / (var_guide + eps)
+        b = mean_mask - a * mean_guide
+        mean_a = cv2.boxFilter(a, -1, window)
+        mean_b = cv2.boxFilter(b, -1, window)
+        
+        # Bilinearly upsample the coefficients strip by strip and apply them to the full-resolution guide
+        scale_x = small_size[0] / width
+        scale_y = small_size[1] / height
+        def render_region(y0, y1):
+            to_small = np.array([
+                [scale_x, 0, 0.5 * scale_x - 0.5],
+                [0, scale_y, (y0 + 0.5) * scale_y - 0.5]
+            ], dtype=np.float32)
+            size = (width, y1 - y0)
+            flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+            a_full = cv2.warpAffine(mean_a, to_small, size, flags=flags, borderMode=cv2.BORDER_REPLICATE)
+            b_full = cv2.warpAffine(mean_b, to_small, size, flags=flags, borderMode=cv2.BORDER_REPLICATE)
+            guide_full = cv2.cvtColor(room_np[y0:y1], cv2.COLOR_RGB2GRAY).astype(np.float32) / 255.0
+            matte = np.clip(a_full * guide_full + b_full, 0, 1)
+            
+            # Fade to the mask with distance from its edge (0 at the edge, 1 from radius + 1 px on),
+            # so the working-resolution ramp is narrowed without a step at the band boundary
+            mask_region = (mask[y0:y1] > 0).astype(np.uint8)
+            inside = cv2.distanceTransform(mask_region, cv2.DIST_L2, 3)
+            outside = cv2.distanceTransform(1 - mask_region, cv2.DIST_L2, 3)
+            weight = np.clip((np.where(mask_region > 0, inside, outside) - 1) / radius, 0, 1)
+            return matte + weight * (mask_region - matte)
+        
+        # Edge distances up to radius + 1 need that many rows of context around each strip
+        return self._render_rows((height, width), np.float32, radius + 1, render_region)
+
+    def _composite_region(self, room_np, surface_np, lighting, matte):
+        """Blend a lit surface region into the matching room region"""
+        room_float = room_np.astype(np.float32) / 255.0
+        surface_float = surface_np.astype(np.float32) / 255.0
         
-        # Create smooth mask
-        mask_3ch = np.stack([mask] * 3, axis=-1).astype(np.float32)
-        mask_smooth = cv2.GaussianBlur(mask_3ch, (5, 5), 0)
+        # Apply lighting
+        lit_surface = np.clip(surface_float * lighting[..., np.newaxis], 0, 1)
         
         # Blend
-        blended = mask_smooth * lit_surface + (1 - mask_smooth) * room_float
+        alpha = matte[..., np.newaxis]
+        blended = alpha * lit_surface + (1 - alpha) * room_float
         return (np.clip(blended, 0, 1) * 255).astype(np.uint8)
 
+    def composite_surface(self, room_image, textured_surface, lighting, matte):
+        """Blend a textured surface into the room using precomputed lighting and alpha matte"""
+        room_np = as_rgb_array(room_image)
+        return self._render_rows(
+            room_np.shape, np.uint8, 0,
+            lambda y0, y1: self._composite_region(
+                room_np[y0:y1], textured_surface[y0:y1], lighting[y0:y1], matte[y0:y1]
+            )
+        )
+
+    def blend_with_lighting(self, room_image, textured_surface, mask, is_floor=True, matte=None):
+        """Blend textured surface with room lighting (pass a precomputed matte to skip mask refinement)"""
+        blend_type = "floor" if is_floor else "wall"
+        print(f"Blending {blend_type} with room lighting...")
+        
+        room_np = as_rgb_array(room_image)
+        if matte is None:
+            matte = self.refine_mask(mask, room_np)
+        
+        def render_region(y0, y1):
+            room_rows = room_np[y0:y1]
+            return self._composite_region(
+                room_rows, textured_surface[y0:y1],
+                self._lighting_region(room_rows, is_floor), matte[y0:y1]
+            )
+        
+        return self._render_rows(room_np.shape, np.uint8, LIGHTING_HALO, render_region)
+
+    def _composite_color_region(self, room_np, color_rgb, lighting, matte):
+        """Blend a lit solid color into the matching room region"""
+        room_float = room_np.astype(np.float32)
+        
+        # Apply lighting to wall color
+        color = np.array(color_rgb, dtype=np.float32) / 255.0
+        lit_color = np.clip(color * lighting[..., np.newaxis], 0, 1) * 255
+        
+        # Blend with original image
+        alpha = matte[..., np.newaxis]
+        blended = alpha * lit_color + (1 - alpha) * room_float
+        return np.clip(blended, 0, 255).astype(np.uint8)
+
+    def composite_color(self, room_image, color_rgb, lighting, matte):
+        """Apply a solid color using precomputed lighting and alpha matte"""
+        room_np = as_rgb_array(room_image)
+        return self._render_rows(
+            room_np.shape, np.uint8, 0,
+            lambda y0, y1: self._composite_color_region(
+                room_np[y0:y1], color_rgb, lighting[y0:y1], matte[y0:y1]
+            )
+        )
+
+    def blend_with_color(self, room_image, mask, color_rgb, matte=None):
+        """Apply a solid color to the masked area using room lighting"""
+        print(f"Blending color {color_rgb} with room lighting...")
+        
+        room_np = as_rgb_array(room_image)
+        if matte is None:
+            matte = self.refine_mask(mask, room_np)
+        
+        return self.composite_color(room_np, color_rgb, self.extract_color_lighting(room_np), matte)
+
     def replace_room_floor_and_walls(self, room_image_path, floor_tile_path, wall_tile_path, 
-                                   output_image_path,
+                                   output_image_path=None,
                                    # Floor tile settings
                                    floor_tiles_x=25, floor_tiles_y=18, floor_grout_width=2,
                                    floor_grout_color=(240, 235, 228),
@@ -336,35 +652,43 @@ class CompleteRoomTiler:
         Main function to replace both floor and walls with tiles
         
         Args:
-            room_image_path (str): Path to room image
-            floor_tile_path (str): Path to floor tile image
-            wall_tile_path (str): Path to wall tile image
-            output_image_path (str): Path to save result
+            room_image_path (str): Path to room image (or its encoded bytes, or the image itself)
+            floor_tile_path (str): Path to floor tile image (or its bytes, or the image)
+            wall_tile_path (str): Path to wall tile image (or its bytes, or the image)
+            output_image_path (str): Path to save result (None returns it without saving)
             floor_tiles_x, floor_tiles_y: Floor tile grid size
             floor_grout_width, floor_grout_color: Floor grout settings
             wall_tiles_x, wall_tiles_y: Wall tile grid size  
             wall_grout_width, wall_grout_color: Wall grout settings
         
         Returns:
-            PIL.Image: Final processed image
+            np.ndarray: Final processed image (uint8 RGB)
         """
         
         # Validate files
         for path in [room_image_path, floor_tile_path, wall_tile_path]:
-            if not os.path.exists(path):
+            if isinstance(path, str) and not os.path.exists(path):
                 raise FileNotFoundError(f"File not found: {path}")
         
         print(f"=== Processing Complete Room Renovation ===")
-        print(f"Room: {room_image_path}")
-        print(f"Floor tile: {floor_tile_path}")
-        print(f"Wall tile: {wall_tile_path}")
-        
-        # Load images
-        room_image = Image.open(room_image_path).convert("RGB")
-        floor_tile = Image.open(floor_tile_path).convert("RGB")
-        wall_tile = Image.open(wall_tile_path).convert("RGB")
-        
-        room_width, room_height = room_image.size
+        if isinstance(room_image_path, str):
+            print(f"Room: {room_image_path}")
+            print(f"Floor tile: {floor_tile_path}")
+            print(f"Wall tile: {wall_tile_path}")
+        
+        def open_image(source):
+            if isinstance(source, str):
+                return Image.open(source)
+            if isinstance(source, bytes):
+                return Image.open(io.BytesIO(source))
+            return source
+        
+        # Load images; the room stays one uint8 array through every stage
+        room_image = as_rgb_array(open_image(room_image_path))
+        floor_tile = open_image(floor_tile_path).convert("RGB")
+        wall_tile = open_image(wall_tile_path).convert("RGB")
+        
+        room_height, room_width = room_image.shape[:2]
         print(f"Room dimensions: {room_width}x{room_height}")
         
         # Step 1: Generate floor tiles
@@ -386,6 +710,10 @@ class CompleteRoomTiler:
         floor_mask = self.detect_floor_mask(room_image)
         wall_mask = self.detect_wall_mask(room_image)
         
+        # Refine both masks against the original room, before either surface is replaced
+        floor_matte = self.refine_mask(floor_mask, room_image)
+        wall_matte = self.refine_mask(wall_mask, room_image)
+        
         # Step 4: Apply floor with perspective
         print(f"\n--- Step 4: Applying Floor Perspective ---")
         warped_floor = self.apply_perspective_to_floor(generated_floor, floor_mask, room_image)
@@ -396,12 +724,16 @@ class CompleteRoomTiler:
         
         # Step 6: Blend floor with lighting
         print(f"\n--- Step 6: Blending Floor ---")
-        room_with_floor = self.blend_with_lighting(room_image, warped_floor, floor_mask, is_floor=True)
+        room_with_floor = self.blend_with_lighting(room_image, warped_floor, floor_mask, is_floor=True,
+                                                   matte=floor_matte)
         
         # Step 7: Blend walls with lighting on the result from step 6
         print(f"\n--- Step 7: Blending Walls ---")
-        room_with_floor_image = Image.fromarray(room_with_floor)
-        final_result = self.blend_with_lighting(room_with_floor_image, wall_texture, wall_mask, is_floor=False)
+        final_result = self.blend_with_lighting(room_with_floor, wall_texture, wall_mask, is_floor=False,
+                                                matte=wall_matte)
+        
+        if output_image_path is None:
+            return final_result
         
         # Step 8: Save result
         print(f"\n--- Step 8: Saving Final Result ---")
@@ -418,4 +750,4 @@ class CompleteRoomTiler:
         print(f"✅ Complete renovation saved to: {output_image_path}")
         print(f"File size: {file_size_mb:.2f} MB")
         
-        return result_image
\ No newline at end of file
+        return final_result
\ No newline at end of file
@@ -0,0 +1,46 @@
+"""
+Shared-memory transport for NumPy arrays passed to render worker processes.
+
+The owning process copies an array into a shared memory segment once and sends
+workers a small picklable SharedArray handle instead of the pixels. Workers map
+the segment as an ndarray without copying. Only the owner unlinks the segment.
+"""
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+
+class SharedArray:
+    """Picklable handle to an ndarray stored in shared memory"""
+
+    def __init__(self, name: str, shape: tuple, dtype: str):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def __repr__(self):
+        return f"SharedArray(name={self.name!r}, shape={self.shape}, dtype={self.dtype})"
+
+
+def share_array(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, SharedArray]:
+    """Copy an array into a new shared memory segment owned by the caller"""
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    return shm, SharedArray(shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(handle: SharedArray) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Map a shared array without copying; close the returned segment once the array is no longer used"""
+    shm = shared_memory.SharedMemory(name=handle.name)
+    array = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+    array.flags.writeable = False
+    return shm, array
+
+
+def release(segments) -> None:
+    """Close and unlink segments created with share_array"""
+    for shm in segments:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,56 @@
+"""
+Strip-based processing helpers for rendering very large room images
+with a bounded working set.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+# (y0, y1, halo_y0, halo_y1): output rows [y0, y1) computed from input rows [halo_y0, halo_y1)
+Strip = Tuple[int, int, int, int]
+
+# Working memory budget; stages that would exceed it run in strips
+DEFAULT_CHUNK_MEMORY_MB = 256
+MIN_STRIP_ROWS = 16
+# Minimum output rows per strip as a multiple of the halo, so halo rows are not mostly recomputed
+MIN_ROWS_PER_HALO = 4
+
+
+def default_workers() -> int:
+    """Worker threads for strip processing (OpenCV/NumPy release the GIL)"""
+    return max(1, min(8, os.cpu_count() or 1))
+
+
+def plan_strips(height: int, width: int, halo: int, bytes_per_pixel: int,
+                memory_budget_mb: int, workers: int) -> Tuple[List[Strip], int]:
+    """
+    Split an image into horizontal strips and choose how many run concurrently.
+
+    Concurrency is lowered until every strip has at least MIN_ROWS_PER_HALO
+    times the halo in output rows, and strip height is then sized so that all
+    in-flight strips, halo rows included, fit the memory budget.
+    """
+    budget_rows = (memory_budget_mb * 1024 * 1024) // max(width * bytes_per_pixel, 1)
+    min_rows = max(MIN_STRIP_ROWS, MIN_ROWS_PER_HALO * halo)
+    workers = max(1, min(workers, budget_rows // (min_rows + 2 * halo)))
+    rows = max(budget_rows // workers - 2 * halo, 1)
+
+    strips = []
+    for y0 in range(0, height, rows):
+        y1 = min(y0 + rows, height)
+        strips.append((y0, y1, max(0, y0 - halo), min(height, y1 + halo)))
+    return strips, workers
+
+
+def run_strips(strips: List[Strip], process_strip: Callable[[int, int, int, int], None],
+               workers: int) -> None:
+    """Run process_strip over every strip, in parallel when more than one worker is configured"""
+    if workers <= 1 or len(strips) <= 1:
+        for strip in strips:
+            process_strip(*strip)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Consume results so exceptions raised in workers propagate
+        for _ in pool.map(lambda strip: process_strip(*strip), strips):
+            pass